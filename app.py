@@ -1,158 +1,692 @@
+import logging
 import os
+import re
+import threading
+import time
 import urllib.parse
-import requests
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from types import MappingProxyType
+from typing import NamedTuple
 
+import orjson
+from flask import Flask, request
 from slack_bolt import App
 from slack_bolt.adapter.flask import SlackRequestHandler
-from flask import Flask, request
 
 # ---------- Environment Variables ----------
 SLACK_BOT_TOKEN = os.environ["SLACK_BOT_TOKEN"]
 SLACK_SIGNING_SECRET = os.environ["SLACK_SIGNING_SECRET"]
 MAPBOX_TOKEN = os.environ.get("MAPBOX_TOKEN")  # Mapbox "pk..." token (optional but recommended)
 UBER_CLIENT_ID = os.environ.get("UBER_CLIENT_ID", "fare-bot")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")  # DEBUG also logs every /fare request
+
+# Geocoding cache: successful lookups are kept for a day, "not found" answers
+# for a few minutes (so a bad query isn't re-sent on every retry), bounded in size
+GEOCODE_CACHE_TTL = 24 * 60 * 60  # seconds
+GEOCODE_NEGATIVE_CACHE_TTL = 10 * 60  # seconds
+GEOCODE_CACHE_MAXSIZE = 4096
+
+# Longest /fare text accepted (~200 chars per address covers any real street
+# address); anything longer is rejected before any parsing or geocoding
+MAX_FARE_TEXT_LENGTH = 400
+
+# /fare listeners run concurrently per process, after ack() (Bolt's default is 5)
+FARE_WORKERS = 32
+
+# Mapbox timeouts and retries; a hung upstream must not hold a worker
+MAPBOX_CONNECT_TIMEOUT = 1.0  # seconds
+MAPBOX_READ_TIMEOUT = 2.0  # seconds, per socket read
+MAPBOX_ATTEMPT_TIMEOUT = MAPBOX_CONNECT_TIMEOUT + MAPBOX_READ_TIMEOUT  # seconds, whole attempt
+MAPBOX_RETRIES = 1
+MAPBOX_RETRY_BACKOFF = 0.1  # seconds; Retry-After headers are ignored
+
+# Worst case for one Mapbox call: every attempt times out, plus the backoff between attempts
+MAPBOX_CALL_BUDGET = (MAPBOX_RETRIES + 1) * MAPBOX_ATTEMPT_TIMEOUT + MAPBOX_RETRIES * MAPBOX_RETRY_BACKOFF
+
+# How long /fare waits for a geocode before falling back to address-only links:
+# the batch call plus the single-address fallback
+GEOCODE_WAIT_TIMEOUT = 2 * MAPBOX_CALL_BUDGET
+
+
+# ---------- Logging ----------
+logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+log = logging.getLogger("farebot")
 
 
 # ---------- Slack/Bolt App ----------
 app = App(
     token=SLACK_BOT_TOKEN,
     signing_secret=SLACK_SIGNING_SECRET,
+    # Answer Slack's HTTP request as soon as a listener calls ack(); the rest of
+    # the listener (geocoding, respond()) keeps running on this thread pool.
+    process_before_response=False,
+    listener_executor=ThreadPoolExecutor(max_workers=FARE_WORKERS),
 )
 
 flask_app = Flask(__name__)
 handler = SlackRequestHandler(app)
 
 
+# ---------- HTTP Client ----------
+# Mapbox is called through urllib3 directly; requests' Session/PreparedRequest/
+# cookie layers add per-call overhead this app doesn't use. urllib3 is only
+# imported when Mapbox is first called; cold starts (and token-less runs) skip it.
+urllib3 = None
+_http = None
+_http_lock = threading.Lock()
+
+
+def get_http():
+    """
+    Return the shared urllib3 PoolManager, creating it on first use. One pool so
+    Mapbox calls reuse keep-alive TLS connections.
+    """
+    global urllib3, _http
+    if _http is None:
+        with _http_lock:
+            if _http is None:
+                import urllib3 as _urllib3
+
+                urllib3 = _urllib3
+                _http = urllib3.PoolManager(
+                    num_pools=10,
+                    maxsize=20,
+                    # accept_encoding=True advertises every codec urllib3 can decode here
+                    # (gzip, deflate, plus br/zstd when installed); bodies are decoded transparently
+                    headers=urllib3.make_headers(user_agent="fare-bot/1.0", accept_encoding=True),
+                    timeout=urllib3.Timeout(
+                        total=MAPBOX_ATTEMPT_TIMEOUT,
+                        connect=MAPBOX_CONNECT_TIMEOUT,
+                        read=MAPBOX_READ_TIMEOUT,
+                    ),
+                    # One quick retry; the batch POST is read-only, so it's safe to retry too.
+                    # A 503's Retry-After would sleep past MAPBOX_CALL_BUDGET, so it's ignored.
+                    retries=urllib3.Retry(
+                        total=MAPBOX_RETRIES,
+                        backoff_factor=MAPBOX_RETRY_BACKOFF,
+                        status_forcelist=(502, 503, 504),
+                        allowed_methods=("GET", "POST"),
+                        respect_retry_after_header=False,
+                        raise_on_status=False,
+                    ),
+                )
+    return _http
+
+
+# Worker threads for running the (I/O-bound) geocoding calls concurrently. Each
+# /fare listener runs at most two (pickup and dropoff), so none ever wait in the
+# queue, where the time would count against the owner's deadline.
+GEO_POOL = ThreadPoolExecutor(max_workers=2 * FARE_WORKERS)
+
+
 # ---------- Mapbox Geocoding ----------
-def geocode_with_mapbox(address: str):
+class Coord(NamedTuple):
+    """
+    A geocoded point; a plain tuple, so cheaper to build and hold than a dict.
+    """
+
+    lat: float
+    lng: float
+
+
+MAPBOX_GEOCODE_URL = "https://api.mapbox.com/geocoding/v5/mapbox.places/"
+MAPBOX_BATCH_URL = "https://api.mapbox.com/search/geocode/v6/batch"
+
+# Everything after the base URLs is fixed, so encode it once
+_MAPBOX_BATCH_QUERY = "?" + urllib.parse.urlencode({"access_token": MAPBOX_TOKEN or ""})
+_MAPBOX_GEOCODE_SUFFIX = ".json?" + urllib.parse.urlencode({
+    "access_token": MAPBOX_TOKEN or "",
+    "limit": 1,
+    # Only the place types a ride can start or end at; full-query (not prefix) matching
+    "types": "address,place,poi,postcode,locality",
+    "autocomplete": "false",
+})
+
+# normalized address -> (expires_at, Coord or None), least recently used first
+_geocode_cache = OrderedDict()
+_geocode_cache_lock = threading.Lock()
+
+# Mapbox lookups currently in progress, so concurrent requests can share them
+_inflight = {}  # normalized address -> Future resolving to Coord or None
+_inflight_lock = threading.Lock()
+
+# Sentinels: nothing cached for an address / the Mapbox call itself failed
+_NOT_CACHED = object()
+_LOOKUP_FAILED = object()
+
+
+def _load_airports() -> dict:
     """
-    Use Mapbox to turn a text address into coordinates.
+    Load the bundled IATA code -> Coord table from airports.json.
+    """
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "airports.json"), "rb") as f:
+        return {code: Coord(lat, lng) for code, (lat, lng) in orjson.loads(f.read()).items()}
+
+
+# Airport codes users type often ("to SFO"); these are answered without calling Mapbox
+IATA_COORDS = _load_airports()
+
+
+def normalize_address(address: str) -> str:
+    """
+    Normalize an address so differences in case and spacing share a cache entry.
+    """
+    return " ".join(address.lower().split())
+
+
+def lookup_airport(address: str):
+    """
+    Return coords for a bare IATA airport code like "SFO", or None.
+    """
+    return IATA_COORDS.get(address.strip().upper())
+
+
+def _cache_get(key: str):
+    """
+    Return the cached result for a normalized address (None for a cached "not found"),
+    or _NOT_CACHED if missing or expired.
+    """
+    with _geocode_cache_lock:
+        entry = _geocode_cache.get(key)
+        if entry is None:
+            return _NOT_CACHED
+        expires_at, coords = entry
+        if time.monotonic() < expires_at:
+            _geocode_cache.move_to_end(key)
+            return coords
+        del _geocode_cache[key]
+        return _NOT_CACHED
+
+
+def _cache_put(key: str, coords):
+    """
+    Cache a result (coords, or None for "not found") for a normalized address,
+    evicting the least recently used entry when full.
+    """
+    ttl = GEOCODE_CACHE_TTL if coords is not None else GEOCODE_NEGATIVE_CACHE_TTL
+    with _geocode_cache_lock:
+        if key in _geocode_cache:
+            _geocode_cache.move_to_end(key)
+        elif len(_geocode_cache) >= GEOCODE_CACHE_MAXSIZE:
+            _geocode_cache.popitem(last=False)
+        _geocode_cache[key] = (time.monotonic() + ttl, coords)
+
+
+def _lookup_local(key: str):
+    """
+    Answer a normalized address from the airport table or the cache, if possible.
+    """
+    coords = lookup_airport(key)
+    return coords if coords is not None else _cache_get(key)
+
+
+def _claim_lookup(key: str):
+    """
+    Register a Mapbox lookup for a normalized address. Returns (future, owner):
+    the first caller owns the lookup and must _finish_lookup() it; concurrent
+    callers get the same future to wait on instead of sending a duplicate request.
+    """
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future, False
+        future = _inflight[key] = Future()
+        return future, True
+
+
+def _finish_lookup(key: str, future, coords):
+    """
+    Publish an owned lookup's result to any waiters and unregister it.
+    """
+    with _inflight_lock:
+        del _inflight[key]
+    future.set_result(coords)
+
+
+def _fetch_and_cache(key: str):
+    """
+    Look up a normalized address on the single-address endpoint and cache the answer.
+    """
+    coords = _geocode_with_mapbox_uncached(key)
+    if coords is _LOOKUP_FAILED:
+        return None
+
+    _cache_put(key, coords)
+    return coords
+
+
+def geocode_batch(addresses):
+    """
+    Geocode several addresses at once. Addresses that normalize the same (e.g. a
+    trip from "Home" to "home") are looked up once. Known airports and cached
+    addresses are answered locally, and addresses another request is already
+    looking up are waited on. Street addresses and postcodes go to Mapbox in a
+    single batch request; everything else (POIs like "Ferry Building", which the
+    batch endpoint can't find) goes straight to the single-address endpoint on
+    GEO_POOL, in parallel with the batch. Addresses the batch can't confidently
+    resolve (or all of them, if it fails) are retried on the single-address endpoint.
+    Results are cached in-process: found for GEOCODE_CACHE_TTL seconds, not found
+    for GEOCODE_NEGATIVE_CACHE_TTL. Failed calls are not cached. Lookups this call
+    owns finish within GEOCODE_WAIT_TIMEOUT, so other requests waiting on them are
+    never dropped early.
 
     Returns:
-        {"lat": float, "lng": float} or None if not found or on error.
+        A list with one Coord or None per address, in order.
     """
-    if not MAPBOX_TOKEN:
-        print("MAPBOX_TOKEN is not set; skipping geocoding.", flush=True)
+    deadline = time.monotonic() + GEOCODE_WAIT_TIMEOUT
+    keys = [normalize_address(address) for address in addresses]
+    # One entry per distinct key, so repeated addresses share a single lookup
+    results = {key: _lookup_local(key) for key in keys}
+    misses = [key for key, coords in results.items() if coords is _NOT_CACHED]
+    for key in misses:
+        results[key] = None
+
+    if misses and not MAPBOX_TOKEN:
+        log.warning("MAPBOX_TOKEN is not set; skipping geocoding.")
+    elif misses:
+        claims = {key: _claim_lookup(key) for key in misses}
+        owned = [key for key, (_, owner) in claims.items() if owner]
+
+        try:
+            batched = [key for key in owned if _looks_like_street_address(key)]
+            pending = {key: GEO_POOL.submit(_fetch_and_cache, key) for key in owned if key not in batched}
+
+            if batched:
+                fetched = _geocode_batch_uncached(batched)
+                for key, coords in zip(batched, fetched):
+                    if coords is not None:
+                        results[key] = coords
+                        _cache_put(key, coords)
+                    else:
+                        # Not a confident batch match; ask the POI-aware single endpoint
+                        pending[key] = GEO_POOL.submit(_fetch_and_cache, key)
+
+            for key, future in pending.items():
+                results[key] = wait_for_coords(future, key, max(0.0, deadline - time.monotonic()))
+        finally:
+            for key in owned:
+                _finish_lookup(key, claims[key][0], results[key])
+
+        for key, (future, owner) in claims.items():
+            if not owner:
+                results[key] = wait_for_coords(future, key)
+
+    return [results[key] for key in keys]
+
+
+def _looks_like_street_address(key: str) -> bool:
+    """
+    Whether a normalized address starts with a house number or postcode, i.e. is
+    something the (address-only, POI-less) batch endpoint can answer.
+    """
+    return key[:1].isdigit()
+
+
+def _geocode_batch_uncached(keys):
+    """
+    Send already-normalized addresses to the Mapbox batch endpoint.
+
+    Returns:
+        A list with one Coord or None per key; all None on error.
+    """
+    body = [
+        {
+            "q": key,
+            "limit": 1,
+            "types": ["address", "place", "postcode", "locality"],
+            "autocomplete": False,
+        }
+        for key in keys
+    ]
+
+    http = get_http()
+    try:
+        resp = http.request(
+            "POST",
+            MAPBOX_BATCH_URL + _MAPBOX_BATCH_QUERY,
+            body=orjson.dumps(body),
+            headers={**http.headers, "Content-Type": "application/json"},
+        )
+    except urllib3.exceptions.HTTPError as e:
+        log.warning("Error calling Mapbox batch for %s: %s", keys, e)
+        return [None] * len(keys)
+
+    if resp.status >= 400:
+        log.warning("Mapbox batch non-200 status %s for %s", resp.status, keys)
+        return [None] * len(keys)
+
+    try:
+        results = [_confident_batch_hit(collection) for collection in orjson.loads(resp.data)["batch"]]
+    except (ValueError, LookupError, TypeError, AttributeError) as e:
+        log.warning("Unreadable Mapbox batch response for %s: %s", keys, e)
+        return [None] * len(keys)
+
+    if len(results) != len(keys):
+        log.warning("Mapbox batch returned %s results for %s queries", len(results), len(keys))
+        return [None] * len(keys)
+    return results
+
+
+# v6 match_code confidence levels trusted without a v5 (POI-aware) second opinion
+_CONFIDENT_MATCHES = frozenset(("exact", "high"))
+
+# v6 feature types taken as-is; only address matches carry a match_code to check
+_PLACE_FEATURE_TYPES = frozenset(("place", "postcode", "locality"))
+
+
+def _confident_batch_hit(collection):
+    """
+    Return the Coord of a batch result's first feature, or None if there is none
+    or Mapbox isn't confident in it. v6 has no POIs, so a query like "1 Moscone Center"
+    can come back as a weak street match; those are left for v5 to answer.
+    """
+    features = collection["features"]
+    if not features:
         return None
 
-    url = f"https://api.mapbox.com/geocoding/v5/mapbox.places/{urllib.parse.quote(address)}.json"
-    params = {
-        "access_token": MAPBOX_TOKEN,
-        "limit": 1,
-    }
+    feature = features[0]
+    properties = feature.get("properties") or {}
+    if properties.get("feature_type") not in _PLACE_FEATURE_TYPES:
+        match_code = properties.get("match_code") or {}
+        if match_code.get("confidence") not in _CONFIDENT_MATCHES:
+            return None
+
+    # GeoJSON coordinates are [lng, lat]
+    lng, lat = feature["geometry"]["coordinates"]
+    return Coord(lat, lng)
 
+
+def _geocode_with_mapbox_uncached(address: str):
+    """
+    Perform the actual Mapbox request for an already-normalized address.
+
+    Returns:
+        Coord(lat, lng), None if Mapbox found nothing, or _LOOKUP_FAILED on error.
+    """
+    if not MAPBOX_TOKEN:
+        log.warning("MAPBOX_TOKEN is not set; skipping geocoding.")
+        return _LOOKUP_FAILED
+
+    url = MAPBOX_GEOCODE_URL + urllib.parse.quote(address, safe="") + _MAPBOX_GEOCODE_SUFFIX
+
+    http = get_http()
     try:
-        resp = requests.get(url, params=params, timeout=5)
-    except Exception as e:
-        print(f"Error calling Mapbox for '{address}': {e}", flush=True)
+        resp = http.request("GET", url)
+    except urllib3.exceptions.HTTPError as e:
+        log.warning("Error calling Mapbox for '%s': %s", address, e)
+        return _LOOKUP_FAILED
+
+    if resp.status >= 400:
+        log.warning("Mapbox non-200 status %s for '%s'", resp.status, address)
+        return _LOOKUP_FAILED
+
+    coords = _scan_first_center(resp.data)
+    if coords is not None:
+        return coords
+
+    try:
+        features = orjson.loads(resp.data).get("features")
+        if features:
+            # Mapbox returns [lng, lat]
+            lng, lat = features[0]["center"]
+    except (ValueError, LookupError, TypeError, AttributeError) as e:
+        log.warning("Unreadable Mapbox response for '%s': %s", address, e)
+        return _LOOKUP_FAILED
+
+    if not features:
+        log.info("Mapbox found no features for '%s'", address)
         return None
+    return Coord(lat, lng)
 
-    if not resp.ok:
-        print(f"Mapbox non-200 status {resp.status_code} for '{address}'", flush=True)
+
+_CENTER_MARKER = b'"center":['
+
+
+def _scan_first_center(data: bytes):
+    """
+    Pull features[0].center straight out of a v5 response body, without building
+    the whole feature tree (only two floats of it are ever used).
+
+    Returns:
+        Coord(lat, lng), or None if it can't be found this way (the caller then
+        does a full parse, which also covers the no-features case).
+    """
+    start = data.find(_CENTER_MARKER)
+    if start == -1:
         return None
 
-    data = resp.json()
-    features = data.get("features")
-    if not features:
-        print(f"Mapbox found no features for '{address}'", flush=True)
+    start += len(_CENTER_MARKER)
+    end = data.find(b"]", start)
+    if end == -1:
         return None
 
-    # Mapbox returns [lng, lat]
-    lng, lat = features[0]["center"]
-    return {"lat": lat, "lng": lng}
+    try:
+        # Mapbox returns [lng, lat]
+        lng, lat = (float(value) for value in data[start:end].split(b","))
+    except ValueError:
+        return None
+    return Coord(lat, lng)
+
+
+def wait_for_coords(future, address: str, timeout=None):
+    """
+    Wait for a pending geocode, treating a timeout like a failed lookup.
+    Waits GEOCODE_WAIT_TIMEOUT seconds unless told otherwise.
+    """
+    try:
+        return future.result(timeout=GEOCODE_WAIT_TIMEOUT if timeout is None else timeout)
+    except FutureTimeoutError:
+        log.warning("Timed out geocoding '%s'", address)
+        return None
 
 
 # ---------- Deep Link Helpers ----------
-def make_uber_link(pickup_address, dropoff_address, pickup_coords=None, dropoff_coords=None) -> str:
+def _encoded_keys(*keys) -> tuple:
     """
-    Build an Uber deep link. If coords are available, include them; otherwise, use addresses only.
+    Percent-encode query keys once, as ready-to-concatenate "key=" fragments.
     """
-    params = {
-        "action": "setPickup",
-        "client_id": UBER_CLIENT_ID,
-    }
+    return tuple(urllib.parse.quote_plus(key) + "=" for key in keys)
+
+
+# The leading params never change, so encode them once at import time
+_UBER_PREFIX = (
+    "https://m.uber.com/ul/?" + urllib.parse.urlencode({"action": "setPickup", "client_id": UBER_CLIENT_ID}) + "&"
+)
+_LYFT_PREFIX = "lyft://ridetype?" + urllib.parse.urlencode({"id": "lyft"}) + "&"
 
-    # Pickup
-    if pickup_coords:
-        params["pickup[latitude]"] = pickup_coords["lat"]
-        params["pickup[longitude]"] = pickup_coords["lng"]
-        params["pickup[formatted_address]"] = pickup_address
-    else:
-        params["pickup[formatted_address]"] = pickup_address
+# Per-place (latitude, longitude, address) keys, pre-encoded
+_UBER_PICKUP_KEYS = _encoded_keys("pickup[latitude]", "pickup[longitude]", "pickup[formatted_address]")
+_UBER_DROPOFF_KEYS = _encoded_keys("dropoff[latitude]", "dropoff[longitude]", "dropoff[formatted_address]")
+_LYFT_PICKUP_KEYS = _encoded_keys("pickup[latitude]", "pickup[longitude]", "pickup[address]")
+_LYFT_DROPOFF_KEYS = _encoded_keys("destination[latitude]", "destination[longitude]", "destination[address]")
 
-    # Dropoff
-    if dropoff_coords:
-        params["dropoff[latitude]"] = dropoff_coords["lat"]
-        params["dropoff[longitude]"] = dropoff_coords["lng"]
-        params["dropoff[formatted_address]"] = dropoff_address
-    else:
-        params["dropoff[formatted_address]"] = dropoff_address
 
-    query = urllib.parse.urlencode(params)
-    return f"https://m.uber.com/ul/?{query}"
+# Anything outside these needs real percent-encoding; most typed addresses don't
+_NEEDS_QUOTING_RE = re.compile(r"[^A-Za-z0-9_.~ ,-]")
+
+
+def quote_address(address: str) -> str:
+    """
+    quote_plus() an address, with a fast path for the common plain-ASCII case
+    (letters, digits, spaces, commas) that only needs two replacements.
+    """
+    if _NEEDS_QUOTING_RE.search(address) is None:
+        return address.replace(" ", "+").replace(",", "%2C")
+    return urllib.parse.quote_plus(address)
+
+
+def _encode_place(keys, address, coords) -> str:
+    """
+    Encode one end of the trip: coords first (if available), then the address.
+    Keys are already encoded, and coords are fixed-point digits (6 places, ~11 cm)
+    that never need quoting, so only the address goes through quote_address().
+    """
+    lat_key, lng_key, address_key = keys
+    if coords:
+        return (
+            f"{lat_key}{coords.lat:.6f}&{lng_key}{coords.lng:.6f}&"
+            + address_key + quote_address(address)
+        )
+    return address_key + quote_address(address)
+
+
+def make_uber_link(pickup_address, dropoff_address, pickup_coords=None, dropoff_coords=None) -> str:
+    """
+    Build an Uber deep link. If coords are available, include them; otherwise, use addresses only.
+    """
+    return (
+        _UBER_PREFIX
+        + _encode_place(_UBER_PICKUP_KEYS, pickup_address, pickup_coords)
+        + "&" + _encode_place(_UBER_DROPOFF_KEYS, dropoff_address, dropoff_coords)
+    )
 
 
 def make_lyft_link(pickup_address, dropoff_address, pickup_coords=None, dropoff_coords=None) -> str:
     """
     Build a Lyft deep link. If coords are available, include them; otherwise, use addresses only.
     """
-    params = {
-        "id": "lyft",
-    }
+    return (
+        _LYFT_PREFIX
+        + _encode_place(_LYFT_PICKUP_KEYS, pickup_address, pickup_coords)
+        + "&" + _encode_place(_LYFT_DROPOFF_KEYS, dropoff_address, dropoff_coords)
+    )
+
+
+# ---------- Slack Responses ----------
+# Fixed ephemeral replies (read-only), passed to respond() as keyword arguments
+FORMAT_ERR = MappingProxyType({
+    "response_type": "ephemeral",
+    "text": "Format: `/fare pickup address to dropoff address`",
+})
+MISSING_ERR = MappingProxyType({
+    "response_type": "ephemeral",
+    "text": "I need both a pickup and a dropoff address.",
+})
+TOO_LONG_ERR = MappingProxyType({
+    "response_type": "ephemeral",
+    "text": f"That's too long. Keep `/fare` to at most {MAX_FARE_TEXT_LENGTH} characters.",
+})
+CONTROL_CHARS_ERR = MappingProxyType({
+    "response_type": "ephemeral",
+    "text": "Addresses can't contain control characters.",
+})
+INTERNAL_ERR = MappingProxyType({
+    "response_type": "ephemeral",
+    "text": "Sorry, something went wrong handling that request.",
+})
+
+# Blocks that never change are built once and shared by every response
+_HEADER_BLOCK = {
+    "type": "header",
+    "text": {
+        "type": "plain_text",
+        "text": "🚕 Fare helper",
+        "emoji": True,
+    },
+}
+_DIVIDER_BLOCK = {"type": "divider"}
+_UBER_BUTTON_TEXT = {"type": "plain_text", "text": "Open in Uber", "emoji": True}
+_LYFT_BUTTON_TEXT = {"type": "plain_text", "text": "Open in Lyft", "emoji": True}
+_CONTEXT_BLOCK = {
+    "type": "context",
+    "elements": [
+        {
+            "type": "mrkdwn",
+            "text": "Links open Uber/Lyft with your trip details as much as each app supports.",
+        }
+    ],
+}
+
+
+def make_fare_blocks(pickup, dropoff, uber_url, lyft_url) -> list:
+    """
+    Build the Block Kit payload for a /fare reply. Only the trip summary and
+    the button URLs depend on the request; the rest are shared constants.
+    """
+    return [
+        _HEADER_BLOCK,
+        {
+            "type": "section",
+            "text": {
+                "type": "mrkdwn",
+                "text": f"*From:* {pickup}\n*To:* {dropoff}",
+            },
+        },
+        _DIVIDER_BLOCK,
+        {
+            "type": "actions",
+            "elements": [
+                {
+                    "type": "button",
+                    "text": _UBER_BUTTON_TEXT,
+                    "url": uber_url,
+                    "action_id": "open_uber",
+                    "style": "primary",
+                },
+                {
+                    "type": "button",
+                    "text": _LYFT_BUTTON_TEXT,
+                    "url": lyft_url,
+                    "action_id": "open_lyft",
+                },
+            ],
+        },
+        _CONTEXT_BLOCK,
+    ]
 
-    # Pickup
-    if pickup_coords:
-        params["pickup[latitude]"] = pickup_coords["lat"]
-        params["pickup[longitude]"] = pickup_coords["lng"]
-    params["pickup[address]"] = pickup_address
 
-    # Dropoff
-    if dropoff_coords:
-        params["destination[latitude]"] = dropoff_coords["lat"]
-        params["destination[longitude]"] = dropoff_coords["lng"]
-    params["destination[address]"] = dropoff_address
+# ---------- Slash Command Handler ----------
+_CONTROL_CHARS_RE = re.compile(r"[\x00-\x1f\x7f]")
 
-    query = urllib.parse.urlencode(params)
-    return f"lyft://ridetype?{query}"
+# "pickup to dropoff", split on the *last* "to" (any case) so pickups like
+# "5th to 6th Ave" survive; one precompiled match instead of a scan plus a split
+_FARE_TEXT_RE = re.compile(r"(.*)\s+to\s+(.*)", re.IGNORECASE | re.DOTALL)
 
 
-# ---------- Slash Command Handler ----------
 @app.command("/fare")
 def handle_fare(ack, respond, command):
     """
     Usage in Slack:
         /fare 45 2nd St San Francisco to SFO
     """
-    # Acknowledge immediately so Slack doesn't time out
+    # Acknowledge immediately so Slack doesn't time out; this also frees the web
+    # worker, and everything below replies via respond() (Slack's response_url)
     ack()
 
     try:
-        text = (command.get("text") or "").strip()
-        print(f"/fare called with text: {text}", flush=True)
-
-        if " to " not in text:
-            respond(
-                response_type="ephemeral",
-                text="Format: `/fare pickup address to dropoff address`",
-            )
+        # Shed empty, oversized or garbage input before doing any other work
+        raw_text = command.get("text") or ""
+        if len(raw_text) > MAX_FARE_TEXT_LENGTH:
+            respond(**TOO_LONG_ERR)
+            return
+
+        text = raw_text.strip()
+        log.debug("/fare called with text: %s", text)
+
+        if not text:
+            respond(**FORMAT_ERR)
+            return
+        if _CONTROL_CHARS_RE.search(text):
+            respond(**CONTROL_CHARS_ERR)
             return
 
-        pickup, dropoff = text.split(" to ", 1)
-        pickup = pickup.strip()
-        dropoff = dropoff.strip()
+        match = _FARE_TEXT_RE.fullmatch(text)
+        if match is None:
+            respond(**FORMAT_ERR)
+            return
+
+        pickup = match.group(1).strip()
+        dropoff = match.group(2).strip()
 
         if not pickup or not dropoff:
-            respond(
-                response_type="ephemeral",
-                text="I need both a pickup and a dropoff address.",
-            )
+            respond(**MISSING_ERR)
             return
 
-        # Try to geocode both addresses with Mapbox (but fall back if it fails)
-        pickup_coords = geocode_with_mapbox(pickup)
-        dropoff_coords = geocode_with_mapbox(dropoff)
+        # Geocode both addresses, with one Mapbox request where possible
+        pickup_coords, dropoff_coords = geocode_batch([pickup, dropoff])
 
-        print(f"Geocoded pickup: {pickup_coords}, dropoff: {dropoff_coords}", flush=True)
+        log.debug("Geocoded pickup: %s, dropoff: %s", pickup_coords, dropoff_coords)
 
         uber_url = make_uber_link(pickup, dropoff, pickup_coords, dropoff_coords)
         lyft_url = make_lyft_link(pickup, dropoff, pickup_coords, dropoff_coords)
@@ -160,66 +694,11 @@ def handle_fare(ack, respond, command):
         # Public message for everyone in the channel, with buttons
         respond(
             response_type="in_channel",
-            blocks=[
-                {
-                    "type": "header",
-                    "text": {
-                        "type": "plain_text",
-                        "text": "🚕 Fare helper",
-                        "emoji": True,
-                    },
-                },
-                {
-                    "type": "section",
-                    "text": {
-                        "type": "mrkdwn",
-                        "text": f"*From:* {pickup}\n*To:* {dropoff}",
-                    },
-                },
-                {"type": "divider"},
-                {
-                    "type": "actions",
-                    "elements": [
-                        {
-                            "type": "button",
-                            "text": {
-                                "type": "plain_text",
-                                "text": "Open in Uber",
-                                "emoji": True,
-                            },
-                            "url": uber_url,
-                            "action_id": "open_uber",
-                            "style": "primary",
-                        },
-                        {
-                            "type": "button",
-                            "text": {
-                                "type": "plain_text",
-                                "text": "Open in Lyft",
-                                "emoji": True,
-                            },
-                            "url": lyft_url,
-                            "action_id": "open_lyft",
-                        },
-                    ],
-                },
-                {
-                    "type": "context",
-                    "elements": [
-                        {
-                            "type": "mrkdwn",
-                            "text": "Links open Uber/Lyft with your trip details as much as each app supports.",
-                        }
-                    ],
-                },
-            ],
+            blocks=make_fare_blocks(pickup, dropoff, uber_url, lyft_url),
         )
     except Exception as e:
-        print(f"ERROR in /fare handler: {e}", flush=True)
-        respond(
-            response_type="ephemeral",
-            text="Sorry, something went wrong handling that request.",
-        )
+        log.exception("Error in /fare handler: %s", e)
+        respond(**INTERNAL_ERR)
 
 
 # ---------- Flask Routing ----------
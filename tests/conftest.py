@@ -0,0 +1,69 @@
+import os
+import sys
+
+import pytest
+import slack_sdk
+from slack_sdk.web import SlackResponse
+
+os.environ.setdefault("SLACK_BOT_TOKEN", "xoxb-test")
+os.environ.setdefault("SLACK_SIGNING_SECRET", "test-secret")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _fake_auth_test(self, **kwargs):
+    # Bolt's App() calls auth.test at import; answer it without the network
+    return SlackResponse(
+        client=self,
+        http_verb="POST",
+        api_url="https://slack.com/api/auth.test",
+        req_args={},
+        data={"ok": True, "user_id": "U0TEST", "bot_id": "B0TEST", "team_id": "T0TEST"},
+        headers={},
+        status_code=200,
+    )
+
+
+slack_sdk.WebClient.auth_test = _fake_auth_test
+
+import app  # noqa: E402
+
+
+class FakeResponse:
+    def __init__(self, data: bytes, status: int = 200):
+        self.data = data
+        self.status = status
+
+
+class FakeHttp:
+    """
+    Stands in for the urllib3 PoolManager. `batch` answers POSTs to the v6 batch
+    endpoint and `single` answers v5 GETs; each gets the request and returns a
+    FakeResponse (or raises). Every request is recorded in `calls`.
+    """
+
+    headers = {}
+
+    def __init__(self, batch=None, single=None):
+        self.batch = batch
+        self.single = single
+        self.calls = []
+
+    def request(self, method, url, body=None, headers=None):
+        self.calls.append((method, url))
+        handler = self.batch if method == "POST" else self.single
+        return handler(url, body)
+
+
+@pytest.fixture
+def fake_http(monkeypatch):
+    import urllib3
+
+    http = FakeHttp()
+    monkeypatch.setattr(app, "urllib3", urllib3)
+    monkeypatch.setattr(app, "_http", http)
+    monkeypatch.setattr(app, "MAPBOX_TOKEN", "pk.test")
+    app._geocode_cache.clear()
+    app._inflight.clear()
+    yield http
+    app._geocode_cache.clear()
+    app._inflight.clear()
@@ -0,0 +1,132 @@
+import urllib.parse
+
+import pytest
+
+import app
+
+ADDRESSES = ["45 2nd St, San Francisco", "SFO [T1]/x", "c&d=e+f", "Café 1", "東京 駅", "x"]
+COORDS = [None, app.Coord(37.1234567, -122.5), app.Coord(-33.9399, 151.1753)]
+
+
+def place_params(keys, address, coords):
+    lat_key, lng_key, address_key = keys
+    params = []
+    if coords:
+        params += [(lat_key, f"{coords.lat:.6f}"), (lng_key, f"{coords.lng:.6f}")]
+    return params + [(address_key, address)]
+
+
+@pytest.fixture
+def fare(monkeypatch):
+    """
+    Run handle_fare on some text with geocoding stubbed out. Returns a function
+    giving (respond kwargs, [pickup, dropoff] sent to geocoding or None).
+    """
+
+    def run(text):
+        geocoded = []
+        replies = []
+
+        def fake_geocode_batch(addresses):
+            geocoded.append(addresses)
+            return [None] * len(addresses)
+
+        monkeypatch.setattr(app, "geocode_batch", fake_geocode_batch)
+        acks = []
+        app.handle_fare(ack=lambda: acks.append(True), respond=lambda **kw: replies.append(kw), command={"text": text})
+
+        assert acks == [True]
+        assert len(replies) == 1
+        return replies[0], (geocoded[0] if geocoded else None)
+
+    return run
+
+
+@pytest.mark.parametrize(
+    "text, pickup, dropoff",
+    [
+        ("45 2nd St San Francisco to SFO", "45 2nd St San Francisco", "SFO"),
+        # Split on the last "to", in any case
+        ("5th to 6th Ave TO SFO", "5th to 6th Ave", "SFO"),
+        ("Home to 1 Road To Nowhere", "Home to 1 Road", "Nowhere"),
+        ("  Home   to   Work  ", "Home", "Work"),
+    ],
+)
+def test_splits_pickup_and_dropoff(fare, text, pickup, dropoff):
+    reply, geocoded = fare(text)
+
+    assert geocoded == [pickup, dropoff]
+    assert reply["response_type"] == "in_channel"
+    assert reply["blocks"][1]["text"]["text"] == f"*From:* {pickup}\n*To:* {dropoff}"
+
+
+@pytest.mark.parametrize("text", ["", None, "   ", "SFO", "toronto", "Home to", "to SFO", "Home tosfo"])
+def test_rejects_text_without_two_addresses(fare, text):
+    reply, geocoded = fare(text)
+
+    assert reply == dict(app.FORMAT_ERR)
+    assert geocoded is None
+
+
+def test_rejects_control_characters(fare):
+    reply, geocoded = fare("Home\x00 to SFO")
+
+    assert reply == dict(app.CONTROL_CHARS_ERR)
+    assert geocoded is None
+
+
+def test_length_limit_counts_padding(fare):
+    text = "Home to SFO"
+
+    reply, geocoded = fare(text.ljust(app.MAX_FARE_TEXT_LENGTH))
+    assert geocoded == ["Home", "SFO"]
+
+    reply, geocoded = fare(text.ljust(app.MAX_FARE_TEXT_LENGTH + 1))
+    assert reply == dict(app.TOO_LONG_ERR)
+    assert geocoded is None
+
+
+def test_geocoding_errors_get_an_internal_error_reply(monkeypatch):
+    def broken(addresses):
+        raise RuntimeError("boom")
+
+    replies = []
+    monkeypatch.setattr(app, "geocode_batch", broken)
+    app.handle_fare(ack=lambda: None, respond=lambda **kw: replies.append(kw), command={"text": "Home to SFO"})
+
+    assert replies == [dict(app.INTERNAL_ERR)]
+
+
+@pytest.mark.parametrize("pickup_coords", COORDS)
+@pytest.mark.parametrize("dropoff_coords", COORDS)
+@pytest.mark.parametrize("pickup, dropoff", list(zip(ADDRESSES, reversed(ADDRESSES))))
+def test_links_match_urlencode(pickup, dropoff, pickup_coords, dropoff_coords):
+    uber = (
+        [("action", "setPickup"), ("client_id", app.UBER_CLIENT_ID)]
+        + place_params(("pickup[latitude]", "pickup[longitude]", "pickup[formatted_address]"), pickup, pickup_coords)
+        + place_params(
+            ("dropoff[latitude]", "dropoff[longitude]", "dropoff[formatted_address]"), dropoff, dropoff_coords
+        )
+    )
+    lyft = (
+        [("id", "lyft")]
+        + place_params(("pickup[latitude]", "pickup[longitude]", "pickup[address]"), pickup, pickup_coords)
+        + place_params(
+            ("destination[latitude]", "destination[longitude]", "destination[address]"), dropoff, dropoff_coords
+        )
+    )
+
+    assert app.make_uber_link(pickup, dropoff, pickup_coords, dropoff_coords) == (
+        "https://m.uber.com/ul/?" + urllib.parse.urlencode(uber)
+    )
+    assert app.make_lyft_link(pickup, dropoff, pickup_coords, dropoff_coords) == (
+        "lyft://ridetype?" + urllib.parse.urlencode(lyft)
+    )
+
+
+def test_lyft_link():
+    assert app.make_lyft_link("45 2nd St, San Francisco", "SFO", None, app.Coord(37.1234567, -122.5)) == (
+        "lyft://ridetype?id=lyft&pickup%5Baddress%5D=45+2nd+St%2C+San+Francisco"
+        "&destination%5Blatitude%5D=37.123457&destination%5Blongitude%5D=-122.500000"
+        "&destination%5Baddress%5D=SFO"
+    )
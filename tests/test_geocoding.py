@@ -0,0 +1,248 @@
+import threading
+import time
+
+import orjson
+
+import app
+from conftest import FakeResponse
+
+
+def batch_hit(lat, lng, feature_type="address", confidence="exact"):
+    properties = {"feature_type": feature_type}
+    if feature_type == "address":
+        # v6 only sends match_code for address matches
+        properties["match_code"] = {"confidence": confidence}
+    return {"features": [{"geometry": {"coordinates": [lng, lat]}, "properties": properties}]}
+
+
+def batch_answer(*collections):
+    return lambda url, body: FakeResponse(orjson.dumps({"batch": list(collections)}))
+
+
+def single_answer(lat, lng):
+    return lambda url, body: FakeResponse(orjson.dumps({"features": [{"center": [lng, lat]}]}))
+
+
+def single_not_found(url, body):
+    return FakeResponse(b'{"type":"FeatureCollection","features":[]}')
+
+
+def run_in_thread(target, *args):
+    """Start target(*args) on a thread; returns (thread, result dict)."""
+    out = {}
+
+    def run():
+        try:
+            out["value"] = target(*args)
+        except Exception as e:
+            out["error"] = e
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, out
+
+
+def watch_claims(monkeypatch):
+    """Return an Event set once some caller joins another request's lookup."""
+    joined = threading.Event()
+    claim = app._claim_lookup
+
+    def spy(key):
+        future, owner = claim(key)
+        if not owner:
+            joined.set()
+        return future, owner
+
+    monkeypatch.setattr(app, "_claim_lookup", spy)
+    return joined
+
+
+def test_airports_skip_mapbox(fake_http):
+    assert app.geocode_batch([" sfo", "JFK"]) == [app.IATA_COORDS["SFO"], app.IATA_COORDS["JFK"]]
+    assert fake_http.calls == []
+
+
+def test_repeated_address_is_looked_up_once(fake_http):
+    fake_http.batch = batch_answer(batch_hit(37.79, -122.39))
+
+    pickup, dropoff = app.geocode_batch(["1 Main St", "  1 main st "])
+
+    assert pickup == dropoff == app.Coord(37.79, -122.39)
+    assert len(fake_http.calls) == 1
+    assert app._geocode_cache["1 main st"][1] == app.Coord(37.79, -122.39)
+
+
+def test_concurrent_requests_share_one_lookup(fake_http, monkeypatch):
+    release = threading.Event()
+
+    def slow_single(url, body):
+        release.wait(5)
+        return single_answer(37.79, -122.39)(url, body)
+
+    fake_http.single = slow_single
+    joined = watch_claims(monkeypatch)
+
+    owner, owner_out = run_in_thread(app.geocode_batch, ["Ferry Building"])
+    waiter, waiter_out = run_in_thread(app.geocode_batch, ["ferry  building"])
+    assert joined.wait(5)
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+
+    assert owner_out["value"] == waiter_out["value"] == [app.Coord(37.79, -122.39)]
+    assert len(fake_http.calls) == 1
+    assert app._inflight == {}
+
+
+def test_waiters_are_released_when_the_owner_fails(fake_http, monkeypatch):
+    release = threading.Event()
+
+    def broken_batch(url, body):
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    fake_http.batch = broken_batch
+    joined = watch_claims(monkeypatch)
+
+    owner, owner_out = run_in_thread(app.geocode_batch, ["1 Ferry Building"])
+    waiter, waiter_out = run_in_thread(app.geocode_batch, ["1 Ferry Building"])
+    assert joined.wait(5)
+    started = time.monotonic()
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+
+    assert isinstance(owner_out["error"], RuntimeError)
+    assert waiter_out["value"] == [None]
+    # Released by the owner, not by timing out
+    assert time.monotonic() - started < app.GEOCODE_WAIT_TIMEOUT
+    assert app._inflight == {}
+    assert "1 ferry building" not in app._geocode_cache
+
+
+def test_owner_finishes_within_the_wait_timeout(fake_http, monkeypatch):
+    monkeypatch.setattr(app, "GEOCODE_WAIT_TIMEOUT", 0.3)
+
+    def slow_empty_batch(url, body):
+        time.sleep(0.25)
+        return batch_answer({"features": []})(url, body)
+
+    fake_http.batch = slow_empty_batch
+    release = threading.Event()
+    done = threading.Event()
+
+    def hung_single(url, body):
+        release.wait(5)
+        done.set()
+        return FakeResponse(b"", status=504)
+
+    fake_http.single = hung_single
+
+    started = time.monotonic()
+    assert app.geocode_batch(["1 Ferry Building"]) == [None]
+    # The slow batch eats into the fallback's time, so waiters never outlast the owner
+    assert time.monotonic() - started < 0.45
+    assert app._inflight == {}
+
+    # Let the abandoned fallback finish before the next test
+    release.set()
+    assert done.wait(5)
+
+
+def test_postcode_batch_hit_is_used_without_match_code(fake_http):
+    fake_http.batch = batch_answer(batch_hit(37.80, -122.27, feature_type="postcode"))
+
+    assert app.geocode_batch(["94612"]) == [app.Coord(37.80, -122.27)]
+    assert [method for method, _ in fake_http.calls] == ["POST"]
+
+
+def test_places_and_pois_skip_the_batch(fake_http):
+    fake_http.batch = batch_answer(batch_hit(37.78, -122.40))
+    fake_http.single = single_answer(37.80, -122.27)
+
+    assert app.geocode_batch(["Oakland", "747 Howard St"]) == [
+        app.Coord(37.80, -122.27),
+        app.Coord(37.78, -122.40),
+    ]
+    assert sorted(method for method, _ in fake_http.calls) == ["GET", "POST"]
+
+
+def test_unreadable_batch_falls_back_to_single_endpoint(fake_http):
+    fake_http.batch = lambda url, body: FakeResponse(b"<html>Bad Gateway</html>")
+    fake_http.single = single_answer(37.78, -122.40)
+
+    assert app.geocode_batch(["747 Howard St"]) == [app.Coord(37.78, -122.40)]
+    assert [method for method, _ in fake_http.calls] == ["POST", "GET"]
+
+
+def test_low_confidence_batch_hit_falls_back_to_single_endpoint(fake_http):
+    fake_http.batch = batch_answer(batch_hit(37.0, -122.0, confidence="low"))
+    fake_http.single = single_answer(37.78, -122.40)
+
+    assert app.geocode_batch(["747 Howard St"]) == [app.Coord(37.78, -122.40)]
+    assert [method for method, _ in fake_http.calls] == ["POST", "GET"]
+
+
+def test_unreadable_single_answer_fails_only_that_address(fake_http):
+    fake_http.batch = batch_answer(batch_hit(37.78, -122.40))
+
+    def broken_single(url, body):
+        if "pier" in url:
+            return FakeResponse(b"<html>oops</html>")
+        return FakeResponse(b'{"features":[{"id":"poi.1"}]}')
+
+    fake_http.single = broken_single
+
+    assert app.geocode_batch(["Pier 39", "Ferry Building", "747 Howard St"]) == [
+        None,
+        None,
+        app.Coord(37.78, -122.40),
+    ]
+    assert list(app._geocode_cache) == ["747 howard st"]
+
+
+def test_not_found_is_cached(fake_http):
+    fake_http.batch = batch_answer({"features": []})
+    fake_http.single = single_not_found
+
+    assert app.geocode_batch(["1 Nowhere Land"]) == [None]
+    assert app.geocode_batch(["1 nowhere  land"]) == [None]
+    assert [method for method, _ in fake_http.calls] == ["POST", "GET"]
+
+
+def test_failed_lookup_is_not_cached(fake_http):
+    fake_http.batch = lambda url, body: FakeResponse(b"", status=503)
+    fake_http.single = lambda url, body: FakeResponse(b"", status=503)
+
+    assert app.geocode_batch(["1 Ferry Building", "Ferry Building"]) == [None, None]
+    assert app._geocode_cache == {}
+
+
+def test_cache_evicts_least_recently_used(fake_http, monkeypatch):
+    monkeypatch.setattr(app, "GEOCODE_CACHE_MAXSIZE", 2)
+    app._cache_put("home", app.Coord(1.0, 1.0))
+    app._cache_put("office", app.Coord(2.0, 2.0))
+
+    assert app._cache_get("home") == app.Coord(1.0, 1.0)
+    app._cache_put("gym", app.Coord(3.0, 3.0))
+
+    assert app._cache_get("office") is app._NOT_CACHED
+    assert app._cache_get("home") == app.Coord(1.0, 1.0)
+    assert app._cache_get("gym") == app.Coord(3.0, 3.0)
+
+
+def test_http_client_stays_within_the_call_budget(monkeypatch):
+    monkeypatch.setattr(app, "_http", None)
+    http = app.get_http()
+    retries = http.connection_pool_kw["retries"]
+    timeout = http.connection_pool_kw["timeout"]
+
+    assert not retries.respect_retry_after_header
+    worst_case = (retries.total + 1) * timeout.total + retries.total * retries.backoff_factor
+    assert worst_case <= app.MAPBOX_CALL_BUDGET
+    assert 2 * app.MAPBOX_CALL_BUDGET <= app.GEOCODE_WAIT_TIMEOUT
+
+
+def test_geo_pool_fits_every_listener():
+    # Two single-address lookups per /fare listener, with no queueing
+    assert app.GEO_POOL._max_workers >= 2 * app.app.listener_runner.listener_executor._max_workers